@@ -15,6 +15,9 @@ from . import app_settings
 import logging
 LOGGER = logging.getLogger(__name__)
 
+#: OpenTSDB URIs which have rejected array-style query output.
+ARRAYS_UNSUPPORTED = set()
+
 
 class OpenTSDBNodeMixin(object):
     def __init__(self, name, *args):
@@ -54,6 +57,48 @@ def get_opentsdb_url(opentsdb_uri, url):
     return requests.get(full_url).json()
 
 
+def query_opentsdb(opentsdb_uri, query):
+    '''
+    Run a query against OpenTSDB, asking for array-style datapoints.
+
+    TSDs which don't know the option ignore it and return the default
+    output. One which rejects it by name is queried without it from then on.
+    '''
+    full_url = "%s/query?%s" % (opentsdb_uri, query)
+    if opentsdb_uri not in ARRAYS_UNSUPPORTED:
+        response = requests.get(full_url + '&arrays=true')
+        if not rejects_arrays(response):
+            return response.json()
+        LOGGER.info("%s does not support arrays=true, falling back", opentsdb_uri)
+        ARRAYS_UNSUPPORTED.add(opentsdb_uri)
+    return requests.get(full_url).json()
+
+
+def rejects_arrays(response):
+    '''
+    Check whether an OpenTSDB error response is complaining about arrays=true.
+    '''
+    if response.status_code != 400:
+        return False
+    try:
+        message = response.json()['error']['message']
+    except (ValueError, KeyError, TypeError):
+        return False
+    return 'arrays' in message
+
+
+def iter_datapoints(dps):
+    '''
+    Yield (timestamp, value) pairs from either OpenTSDB datapoint format.
+    '''
+    if isinstance(dps, dict):
+        for timestamp, value in dps.items():
+            yield int(timestamp), value
+    else:
+        for timestamp, value in dps:
+            yield timestamp, value
+
+
 def find_opentsdb_nodes(opentsdb_uri, query_parts, current_branch, shared_reader, path=''):
     query_regex = re.compile(query_parts[0])
     for node, node_data in get_branch_nodes(opentsdb_uri, current_branch, shared_reader, path):
@@ -138,14 +183,13 @@ class SharedReader(object):
 
         if self.workers[key].acquire(False):
             # we are the worker, do the work
-            data = requests.get("%s/query?m=sum:%ds-avg:%s{%s}&start=%d&end=%d&show_tsuids=true" % (
-                opentsdb_uri,
+            data = query_opentsdb(opentsdb_uri, "m=sum:%ds-avg:%s{%s}&start=%d&end=%d&show_tsuids=true" % (
                 aggregation_interval,
                 leaf_data['metric'],
                 ','.join(["%s=*" % t for t in leaf_data['tags']]),
                 start,
                 end,
-            )).json()
+            ))
 
             self.results[key] = {}
             for metric in data:
@@ -185,21 +229,19 @@ class OpenTSDBReader(object):
                     int(endTime),
                 )
             else:
-                data = requests.get("%s/query?tsuid=sum:%ds-avg:%s&start=%d&end=%d" % (
-                    self.opentsdb_uri,
+                data = query_opentsdb(self.opentsdb_uri, "tsuid=sum:%ds-avg:%s&start=%d&end=%d" % (
                     app_settings.OPENTSDB_DEFAULT_AGGREGATION_INTERVAL,
                     self.leaf_data['tsuid'],
                     int(startTime),
                     int(endTime),
-                )).json()
+                ))
 
             time_info = (startTime, endTime, self.step)
             number_points = int((endTime-startTime)//self.step)
             datapoints = [None for i in range(number_points)]
 
             for series in data:
-                for timestamp, value in series['dps'].items():
-                    timestamp = int(timestamp)
+                for timestamp, value in iter_datapoints(series['dps']):
                     interval = timestamp - (timestamp % app_settings.OPENTSDB_DEFAULT_AGGREGATION_INTERVAL)
                     index = (interval - int(startTime)) // self.step
                     datapoints[index] = value
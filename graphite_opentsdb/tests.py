@@ -7,6 +7,7 @@ from django.core.cache import cache
 from httmock import all_requests, with_httmock, HTTMock
 import mock
 
+from graphite_opentsdb import finder as opentsdb_finder
 from graphite_opentsdb.finder import OpenTSDBFinder
 from graphite.storage import FindQuery
 from graphite_opentsdb import app_settings
@@ -184,6 +185,125 @@ def mocked_urls(url, request):
         }
     )
 
+@all_requests
+def mocked_queries(url, request):
+    return {
+        ('localhost:4242', '/api/v1/query', 'tsuid=sum:15s-avg:000BC700000100047A&start=0&end=60&arrays=true'): {
+            'status_code': 200,
+            'content': '''
+                [
+                    {
+                        "metric": "leaf",
+                        "tags": {
+                            "host": "localhost"
+                        },
+                        "aggregateTags": [],
+                        "dps": [
+                            [0, 1.0],
+                            [30, 3.0]
+                        ]
+                    }
+                ]
+            ''',
+        },
+        ('localhost:4242', '/api/v1/query', 'm=sum:15s-avg:leaf%7Bhost=*%7D&start=0&end=60&show_tsuids=true&arrays=true'): {
+            'status_code': 200,
+            'content': '''
+                [
+                    {
+                        "metric": "leaf",
+                        "tags": {
+                            "host": "localhost"
+                        },
+                        "aggregateTags": [],
+                        "tsuids": ["000BC700000100047A"],
+                        "dps": [
+                            [0, 1.0],
+                            [30, 3.0]
+                        ]
+                    }
+                ]
+            ''',
+        },
+        ('localhost:4242', '/api/v1/query', 'tsuid=sum:15s-avg:000BC700000100047B&start=0&end=60&arrays=true'): {
+            'status_code': 400,
+            'content': '''
+                {
+                    "error": {
+                        "code": 400,
+                        "message": "No such name for 'metrics': 'missing'"
+                    }
+                }
+            ''',
+        },
+    }.get(
+        (url.netloc, url.path, url.query),
+        mocked_urls(url, request),
+    )
+
+@all_requests
+def mocked_queries_ignoring_arrays(url, request):
+    return {
+        ('localhost:4242', '/api/v1/query', 'tsuid=sum:15s-avg:000BC700000100047A&start=0&end=60&arrays=true'): {
+            'status_code': 200,
+            'content': '''
+                [
+                    {
+                        "metric": "leaf",
+                        "tags": {
+                            "host": "localhost"
+                        },
+                        "aggregateTags": [],
+                        "dps": {
+                            "0": 1.0,
+                            "30": 3.0
+                        }
+                    }
+                ]
+            ''',
+        },
+    }.get(
+        (url.netloc, url.path, url.query),
+        mocked_urls(url, request),
+    )
+
+@all_requests
+def mocked_queries_rejecting_arrays(url, request):
+    return {
+        ('localhost:4242', '/api/v1/query', 'tsuid=sum:15s-avg:000BC700000100047A&start=0&end=60&arrays=true'): {
+            'status_code': 400,
+            'content': '''
+                {
+                    "error": {
+                        "code": 400,
+                        "message": "Unrecognized parameter: arrays"
+                    }
+                }
+            ''',
+        },
+        ('localhost:4242', '/api/v1/query', 'tsuid=sum:15s-avg:000BC700000100047A&start=0&end=60'): {
+            'status_code': 200,
+            'content': '''
+                [
+                    {
+                        "metric": "leaf",
+                        "tags": {
+                            "host": "localhost"
+                        },
+                        "aggregateTags": [],
+                        "dps": {
+                            "0": 1.0,
+                            "30": 3.0
+                        }
+                    }
+                ]
+            ''',
+        },
+    }.get(
+        (url.netloc, url.path, url.query),
+        mocked_urls(url, request),
+    )
+
 @all_requests
 def bad_urls(url, request):
     return {
@@ -199,6 +319,7 @@ class OpenTSDBFinderTestCase(test.TestCase):
         #self.settings_dict = copy.deepcopy(self.BASE_SETTINGS)
         self.finder = OpenTSDBFinder('http://localhost:4242/api/v1', 1)
         cache.clear()
+        opentsdb_finder.ARRAYS_UNSUPPORTED.clear()
 
     @mock.patch.object(app_settings, 'OPENTSDB_URI', 'http://localhost:9999')
     @mock.patch.object(app_settings, 'OPENTSDB_TREE', 999)
@@ -325,3 +446,98 @@ class OpenTSDBFinderTestCase(test.TestCase):
                 [node.path for node in nodes],
                 ['branch1', 'branch2', 'leaf'],
             )
+
+    def fetch_leaf(self):
+        nodes = list(self.finder.find_nodes(query=FindQuery('leaf', None, None)))
+        return nodes[0].fetch(0, 60).waitForResults()
+
+    @with_httmock(mocked_queries)
+    def test_fetch_arrays(self):
+        '''
+        Test that fetches decode array-style datapoints.
+        '''
+
+        time_info, datapoints = self.fetch_leaf()
+
+        self.assertEqual(time_info, (0, 60, 15))
+        self.assertEqual(datapoints, [1.0, None, 3.0, None])
+
+    @with_httmock(mocked_queries)
+    @mock.patch.object(app_settings, 'OPENTSDB_METRIC_QUERY_LIMIT', 0)
+    def test_fetch_shared_arrays(self):
+        '''
+        Test that fetches by metric decode array-style datapoints.
+        '''
+
+        time_info, datapoints = self.fetch_leaf()
+
+        self.assertEqual(time_info, (0, 60, 15))
+        self.assertEqual(datapoints, [1.0, None, 3.0, None])
+
+    @with_httmock(mocked_queries_ignoring_arrays)
+    def test_fetch_arrays_ignored(self):
+        '''
+        Test that fetches decode the default output from TSDs which
+        ignore arrays=true.
+        '''
+
+        time_info, datapoints = self.fetch_leaf()
+
+        self.assertEqual(time_info, (0, 60, 15))
+        self.assertEqual(datapoints, [1.0, None, 3.0, None])
+        self.assertEqual(opentsdb_finder.ARRAYS_UNSUPPORTED, set())
+
+    @with_httmock(mocked_queries_rejecting_arrays)
+    def test_fetch_arrays_rejected(self):
+        '''
+        Test that fetches fall back when OpenTSDB rejects arrays=true.
+        '''
+
+        time_info, datapoints = self.fetch_leaf()
+
+        self.assertEqual(time_info, (0, 60, 15))
+        self.assertEqual(datapoints, [1.0, None, 3.0, None])
+        self.assertIn('http://localhost:4242/api/v1', opentsdb_finder.ARRAYS_UNSUPPORTED)
+
+    def test_query_error(self):
+        '''
+        Test that other query errors are returned as-is, without a retry
+        or disabling arrays=true.
+        '''
+
+        queries = []
+
+        @all_requests
+        def recorded_queries(url, request):
+            queries.append(url.query)
+            return mocked_queries(url, request)
+
+        with HTTMock(recorded_queries):
+            data = opentsdb_finder.query_opentsdb(
+                'http://localhost:4242/api/v1',
+                'tsuid=sum:15s-avg:000BC700000100047B&start=0&end=60',
+            )
+
+        self.assertEqual(data['error']['code'], 400)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(opentsdb_finder.ARRAYS_UNSUPPORTED, set())
+
+    def test_gzip(self):
+        '''
+        Test that requests to OpenTSDB accept gzip-compressed responses.
+        '''
+
+        encodings = []
+
+        @all_requests
+        def recorded_queries(url, request):
+            encodings.append(request.headers.get('Accept-Encoding', ''))
+            return mocked_queries(url, request)
+
+        with HTTMock(recorded_queries):
+            self.fetch_leaf()
+
+        # One tree request and one query
+        self.assertEqual(len(encodings), 2)
+        for encoding in encodings:
+            self.assertIn('gzip', encoding)